@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the SIA evaluation scripts.
+
+Runs a command such as `eval_vlguard.py --help` in a fresh interpreter
+with `-X importtime` and reports:
+- Wall-clock time of the whole invocation
+- The slowest imports by cumulative time
+- Any forbidden heavy module (torch, transformers, ECSO's llava, ...) that
+  got imported even though no model is loaded
+
+Exits non-zero if a forbidden module was imported or the wall time
+exceeds the budget, so it can be used as a startup regression check:
+    python bench_startup.py
+    python bench_startup.py --budget-ms 300 -- eval_vlguard.py --dry-run --data-file data.json
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+
+DEFAULT_FORBIDDEN = ['torch', 'transformers', 'llava', 'accelerate', 'qwen_vl_utils', 'numpy', 'PIL', 'tqdm']
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """
+    Parse `-X importtime` output.
+
+    Each line has the form:
+        import time: <self us> | <cumulative us> | <indented module name>
+
+    Args:
+        stderr: Captured stderr of the benchmarked process
+
+    Returns:
+        List of dicts with 'module', 'self_us', 'cumulative_us' and 'depth'
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header line
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        entries.append({
+            'module': stripped,
+            'self_us': int(fields[0]),
+            'cumulative_us': int(fields[1]),
+            'depth': (len(name) - len(stripped) - 1) // 2
+        })
+    return entries
+
+
+def run_startup(command: List[str], cwd: str) -> Dict:
+    """
+    Run a command with `-X importtime` and collect timings.
+
+    Args:
+        command: Script and arguments to run with the current interpreter
+        cwd: Working directory
+
+    Returns:
+        Dictionary with 'wall_ms', 'returncode' and 'imports'
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + command,
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    return {
+        'wall_ms': wall_ms,
+        'returncode': proc.returncode,
+        'imports': parse_importtime(proc.stderr)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure startup time and import breakdown of SIA scripts"
+    )
+    parser.add_argument("--budget-ms", type=float, default=500.0,
+                       help="Fail if wall time exceeds this many milliseconds")
+    parser.add_argument("--top", type=int, default=15,
+                       help="Number of slowest imports to show")
+    parser.add_argument("--forbid", type=str, default=",".join(DEFAULT_FORBIDDEN),
+                       help="Comma-separated top-level modules that must not be imported")
+    parser.add_argument("--repeat", type=int, default=3,
+                       help="Number of runs (best wall time is reported)")
+    parser.add_argument("command", nargs=argparse.REMAINDER,
+                       help="Script and arguments to benchmark (default: eval_vlguard.py --help)")
+
+    args = parser.parse_args()
+
+    # Only a leading '--' separates our options; later ones belong to the script
+    if args.command[:1] == ['--']:
+        args.command = args.command[1:]
+    command = args.command or ['eval_vlguard.py', '--help']
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    runs = [run_startup(command, cwd) for _ in range(max(args.repeat, 1))]
+    best = min(runs, key=lambda r: r['wall_ms'])
+
+    print("="*60)
+    print(f"Startup benchmark: {' '.join(command)}")
+    print("="*60)
+    print(f"Wall time (best of {len(runs)}): {best['wall_ms']:.1f} ms "
+          f"(budget {args.budget_ms:.0f} ms)")
+    print(f"Exit code: {best['returncode']}")
+
+    total_us = sum(e['cumulative_us'] for e in best['imports'] if e['depth'] == 0)
+    print(f"Total import time: {total_us / 1000:.1f} ms "
+          f"({len(best['imports'])} modules)")
+
+    print("\nSlowest top-level imports (cumulative):")
+    top_level = sorted(
+        (e for e in best['imports'] if e['depth'] == 0),
+        key=lambda e: e['cumulative_us'],
+        reverse=True
+    )
+    for entry in top_level[:args.top]:
+        print(f"  {entry['cumulative_us'] / 1000:8.1f} ms  {entry['module']}")
+
+    forbidden = {m for m in args.forbid.split(',') if m}
+    imported = sorted({
+        e['module'] for e in best['imports']
+        if e['module'].split('.')[0] in forbidden
+    })
+
+    failures = []
+    if best['returncode'] != 0:
+        failures.append(f"command exited with {best['returncode']}")
+    if imported:
+        failures.append(f"heavy modules imported at startup: {', '.join(imported[:10])}")
+    if best['wall_ms'] > args.budget_ms:
+        failures.append(f"wall time {best['wall_ms']:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+
+    print("="*60)
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
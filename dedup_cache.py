@@ -0,0 +1,325 @@
+"""
+Near-duplicate cache for Stage 2 intent inference.
+
+Safety benchmarks (SPA-VL, BeaverTails, HADES, ...) contain many templated
+queries that differ by only a word or two and come with similar captions.
+This module lets the SIA pipeline reuse a previous Stage 2 output when a new
+(caption, query) pair is a near-duplicate of one already seen:
+- Normalized caption and query are split into character shingles
+- Separate MinHash signatures estimate caption and query similarity, so a
+  long caption cannot mask a query that changes the intent
+- LSH banding on the caption finds candidates without scanning the cache
+- A candidate is reused only if both caption and query pass their checks
+"""
+
+import hashlib
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+
+# Mersenne prime used for the universal hash family (same as datasketch)
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text before shingling.
+
+    Lowercases, drops punctuation and collapses whitespace so that trivial
+    formatting differences do not affect similarity.
+
+    Args:
+        text: Raw caption or query
+
+    Returns:
+        Normalized text
+    """
+    text = text.lower()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def shingle(text: str, shingle_size: int = 5) -> Set[str]:
+    """
+    Build the character shingle set of a caption or query.
+
+    Args:
+        text: Raw caption or query
+        shingle_size: Number of characters per shingle
+
+    Returns:
+        Set of shingle strings
+    """
+    text = normalize_text(text)
+    if len(text) <= shingle_size:
+        return {text}
+    return {text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1)}
+
+
+def _optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Pick LSH (bands, rows) so the S-curve midpoint is close to threshold.
+
+    The probability that two samples with Jaccard similarity s share a
+    bucket is 1 - (1 - s^r)^b, whose midpoint is roughly (1/b)^(1/r).
+
+    Args:
+        threshold: Target Jaccard similarity
+        num_perm: Number of MinHash permutations
+
+    Returns:
+        Tuple of (bands, rows) with bands * rows == num_perm
+    """
+    best = (num_perm, 1)
+    best_error = float('inf')
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        # Prefer the stricter setting on ties to limit false candidates
+        if error < best_error or (error == best_error and rows > best[1]):
+            best = (bands, rows)
+            best_error = error
+    return best
+
+
+def _histogram(values: List[float], num_bins: int) -> Dict[str, int]:
+    counts = [0] * num_bins
+    for value in values:
+        counts[min(int(value * num_bins), num_bins - 1)] += 1
+    return {
+        f"{i / num_bins:.1f}-{(i + 1) / num_bins:.1f}": count
+        for i, count in enumerate(counts)
+    }
+
+
+class Stage2DedupCache:
+    """
+    MinHash/LSH cache of Stage 2 outputs keyed by (caption, query).
+
+    Captions and queries are compared separately. A lookup returns the
+    stored entry with the most similar caption among those whose caption
+    similarity is at least `threshold` and whose query either matches
+    exactly after normalization (default) or reaches `query_threshold`.
+    Every lookup is recorded so that hit rate and both similarity
+    distributions can be reported for tuning.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        query_threshold: Optional[float] = None,
+        num_perm: int = 128,
+        shingle_size: int = 5,
+        seed: int = 1
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            threshold: Minimum estimated caption Jaccard similarity for reuse
+            query_threshold: Minimum estimated query Jaccard similarity for
+                reuse; None requires the normalized queries to be identical
+            num_perm: Number of MinHash permutations (signature length)
+            shingle_size: Number of characters per shingle
+            seed: Seed for the hash permutations
+        """
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError(f"threshold must be in (0, 1], got {threshold}")
+        if query_threshold is not None and not 0.0 < query_threshold <= 1.0:
+            raise ValueError(f"query_threshold must be in (0, 1], got {query_threshold}")
+
+        self.threshold = threshold
+        self.query_threshold = query_threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = _optimal_bands(threshold, num_perm)
+
+        # Universal hash family h(x) = (a * x + b) mod p, derived from seed
+        self._permutations = []
+        for i in range(num_perm):
+            digest = hashlib.blake2b(f"{seed}:{i}".encode('utf-8'), digest_size=16).digest()
+            a = int.from_bytes(digest[:8], 'little') % (_MERSENNE_PRIME - 1) + 1
+            b = int.from_bytes(digest[8:], 'little') % _MERSENNE_PRIME
+            self._permutations.append((a, b))
+
+        self._entries: List[Dict] = []
+        self._buckets: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(self.bands)]
+
+        # Lookup statistics (best candidate of every lookup)
+        self.lookups = 0
+        self.hits = 0
+        self.caption_similarities: List[float] = []
+        self.query_similarities: List[float] = []
+
+    def _minhash(self, text: str) -> List[int]:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little')
+            for s in shingle(text, self.shingle_size)
+        ]
+        return [
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._permutations
+        ]
+
+    def signature(self, caption: str, query: str) -> Dict:
+        """
+        Compute the MinHash signatures of a (caption, query) pair.
+
+        Args:
+            caption: Stage 1 caption
+            query: User query
+
+        Returns:
+            Dict with 'caption' and 'query' signatures (lists of `num_perm`
+            hash minima) and the 'normalized_query' text
+        """
+        return {
+            'caption': self._minhash(caption),
+            'query': self._minhash(query),
+            'normalized_query': normalize_text(query)
+        }
+
+    def _band_keys(self, signature: List[int]) -> List[Tuple[int, ...]]:
+        return [
+            tuple(signature[i * self.rows:(i + 1) * self.rows])
+            for i in range(self.bands)
+        ]
+
+    @staticmethod
+    def _similarity(sig_a: List[int], sig_b: List[int]) -> float:
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+    def _query_matches(self, signature: Dict, entry: Dict, query_similarity: float) -> bool:
+        if self.query_threshold is None:
+            return signature['normalized_query'] == entry['signature']['normalized_query']
+        return query_similarity >= self.query_threshold
+
+    def lookup(self, caption: str, query: str) -> Tuple[Optional[Dict], Dict]:
+        """
+        Find a stored near-duplicate of (caption, query).
+
+        Args:
+            caption: Stage 1 caption
+            query: User query
+
+        Returns:
+            Tuple of (match, signature). `match` is None on a miss, otherwise
+            a dict with the stored Stage 2 outputs plus 'caption_similarity',
+            'query_similarity', 'source_id' and 'source_query'. The
+            signature can be passed to `add` to avoid recomputing it.
+        """
+        signature = self.signature(caption, query)
+
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature['caption'])):
+            candidates.update(self._buckets[band].get(key, ()))
+
+        # Best reusable candidate, and best candidate overall for statistics
+        best_index = None
+        best_similarities = (0.0, 0.0)
+        closest_similarities = (0.0, 0.0)
+        for index in candidates:
+            entry = self._entries[index]
+            similarities = (
+                self._similarity(signature['caption'], entry['signature']['caption']),
+                self._similarity(signature['query'], entry['signature']['query'])
+            )
+            closest_similarities = max(closest_similarities, similarities)
+            if (similarities[0] >= self.threshold
+                    and self._query_matches(signature, entry, similarities[1])
+                    and similarities > best_similarities):
+                best_index = index
+                best_similarities = similarities
+
+        self.lookups += 1
+        if best_index is None:
+            self.caption_similarities.append(closest_similarities[0])
+            self.query_similarities.append(closest_similarities[1])
+            return None, signature
+
+        self.hits += 1
+        self.caption_similarities.append(best_similarities[0])
+        self.query_similarities.append(best_similarities[1])
+        entry = self._entries[best_index]
+        return {
+            'intent': entry['intent'],
+            'reasoning': entry['reasoning'],
+            'raw_output': entry['raw_output'],
+            'caption_similarity': best_similarities[0],
+            'query_similarity': best_similarities[1],
+            'source_id': entry['source_id'],
+            'source_query': entry['query']
+        }, signature
+
+    def add(
+        self,
+        caption: str,
+        query: str,
+        intent: str,
+        reasoning: str,
+        raw_output: str,
+        source_id=None,
+        signature: Optional[Dict] = None
+    ):
+        """
+        Store a freshly generated Stage 2 output.
+
+        Args:
+            caption: Stage 1 caption
+            query: User query
+            intent: Parsed intent
+            reasoning: Parsed reasoning
+            raw_output: Raw Stage 2 generation
+            source_id: Identifier recorded for auditing reuse (e.g. problem_id)
+            signature: Precomputed signature from `lookup`
+        """
+        if signature is None:
+            signature = self.signature(caption, query)
+
+        index = len(self._entries)
+        self._entries.append({
+            'signature': signature,
+            'query': query,
+            'intent': intent,
+            'reasoning': reasoning,
+            'raw_output': raw_output,
+            'source_id': source_id
+        })
+        for band, key in enumerate(self._band_keys(signature['caption'])):
+            self._buckets[band].setdefault(key, []).append(index)
+
+    def stats(self, num_bins: int = 10) -> Dict:
+        """
+        Summarize cache usage.
+
+        The similarity histograms cover the best candidate of every lookup
+        (0.0 when LSH produced no candidate), for captions and queries.
+
+        Args:
+            num_bins: Number of equal-width histogram bins over [0, 1]
+
+        Returns:
+            Dictionary with hit rate and similarity distributions
+        """
+        matched = [
+            (c, q) for c, q in zip(self.caption_similarities, self.query_similarities)
+            if c > 0.0
+        ]
+        return {
+            'threshold': self.threshold,
+            'query_threshold': self.query_threshold,
+            'num_perm': self.num_perm,
+            'bands': self.bands,
+            'rows': self.rows,
+            'entries': len(self._entries),
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'mean_caption_similarity': sum(c for c, _ in matched) / len(matched) if matched else 0.0,
+            'mean_query_similarity': sum(q for _, q in matched) / len(matched) if matched else 0.0,
+            'caption_similarity_histogram': _histogram(self.caption_similarities, num_bins),
+            'query_similarity_histogram': _histogram(self.query_similarities, num_bins)
+        }
@@ -12,20 +12,150 @@ import argparse
 import os
 import json
 import sys
-from tqdm import tqdm
-from PIL import Image
-
-# Add ECSO path for VLM adapter
-sys.path.insert(0, '/home/gwj/gwj_sdd/baseline/ECSO-main')
-from llava.model.vlm_adapter import create_adapter
+from contextlib import nullcontext
 
 # Add current directory for SIA modules
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from sia_pipeline import SIAPipeline
-from utils import detect_unsafe_intent, detect_refusal, calculate_metrics
+from dedup_cache import Stage2DedupCache
+from utils import detect_unsafe_intent, detect_refusal, calculate_metrics, compare_stage3_paths
+
+# ECSO path for VLM adapter (imported lazily in load_adapter)
+ECSO_PATH = '/home/gwj/gwj_sdd/baseline/ECSO-main'
+
+
+def load_adapter(model_type, model_path):
+    """
+    Create and load the VLM adapter.
+
+    The ECSO adapter stack pulls in torch and transformers, so it is only
+    imported here, once a model is actually needed. This keeps `--help`
+    and `--dry-run` fast.
+
+    Args:
+        model_type: Type of VLM (e.g., qwen2.5-vl)
+        model_path: Path to model weights
+
+    Returns:
+        Loaded VLM adapter
+    """
+    if ECSO_PATH not in sys.path:
+        sys.path.insert(0, ECSO_PATH)
+    from llava.model.vlm_adapter import create_adapter
+
+    adapter = create_adapter(model_type)
+    adapter.load_model(model_path)
+    return adapter
+
+
+def load_data(data_file, offset=0, limit=None):
+    """
+    Load a VLGuard-format dataset and apply offset/limit.
+
+    Args:
+        data_file: Path to dataset JSON (list of items)
+        offset: Starting offset in dataset
+        limit: Maximum number of samples (None for all)
 
+    Returns:
+        List of data items to process
+    """
+    print(f"\nLoading data from {data_file}...")
+    with open(data_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    print(f"Total samples in dataset: {len(data)}")
 
-def process_vlguard_item(item, sia_pipeline):
+    # Apply offset and limit
+    if offset > 0:
+        data = data[offset:]
+        print(f"Starting from offset {offset}")
+
+    if limit:
+        data = data[:limit]
+        print(f"Limited to {limit} samples")
+
+    print(f"Samples to process: {len(data)}")
+    return data
+
+
+def validate_data(data):
+    """
+    Check that every item has the required fields and an existing image.
+
+    Args:
+        data: List of data items
+
+    Returns:
+        List of (problem_id, problem) for invalid items, where problem is
+        a short description of what is wrong
+    """
+    invalid = []
+    for item in data:
+        problem_id = item.get('problem_id', 'unknown')
+        if not all(k in item for k in ['problem_id', 'problem', 'path']):
+            invalid.append((problem_id, "missing required fields"))
+        elif not os.path.exists(item['path']):
+            invalid.append((problem_id, f"image not found: {item['path']}"))
+    return invalid
+
+
+def build_result(item, sia_outputs):
+    """
+    Build the per-sample result record from SIA stage outputs.
+
+    Args:
+        item: VLGuard data item
+        sia_outputs: Dictionary returned by SIAPipeline.run_full_pipeline
+
+    Returns:
+        Result dictionary with original fields, stage outputs and metrics
+    """
+    # Detect unsafe intent and refusal
+    sia_detected_unsafe = detect_unsafe_intent(
+        sia_outputs['stage2_intent'],
+        sia_outputs['stage2_reasoning']
+    )
+    sia_refused = detect_refusal(sia_outputs['stage3_final_response'])
+
+    result = {
+        # Original fields (preserved from VLGuard)
+        'problem_id': item['problem_id'],
+        'problem': item['problem'],
+        'path': item['path'],
+        'problem_type': item.get('problem_type', ''),
+        'data_type': item.get('data_type', ''),
+        'solution': item.get('solution', ''),  # Ground truth
+
+        # SIA stage outputs
+        'stage1_caption': sia_outputs['stage1_caption'],
+        'stage2_intent': sia_outputs['stage2_intent'],
+        'stage2_reasoning': sia_outputs['stage2_reasoning'],
+        'stage2_raw_output': sia_outputs['stage2_raw_output'],
+        'stage3_final_response': sia_outputs['stage3_final_response'],
+
+        # Metrics
+        'sia_detected_unsafe': sia_detected_unsafe,
+        'sia_refused': sia_refused
+    }
+
+    # Audit trail for Stage 2 near-duplicate reuse
+    if 'stage2_cache' in sia_outputs:
+        result['stage2_cache'] = sia_outputs['stage2_cache']
+
+    # Stage 3 path tagging (fast = text-only) and optional full-path comparison
+    if 'stage3_path' in sia_outputs:
+        result['stage3_path'] = sia_outputs['stage3_path']
+        result['stage3_latency_s'] = sia_outputs['stage3_latency_s']
+    if 'stage3_full_response' in sia_outputs:
+        result['stage3_full_response'] = sia_outputs['stage3_full_response']
+        result['stage3_full_latency_s'] = sia_outputs['stage3_full_latency_s']
+        result['sia_refused_full'] = detect_refusal(sia_outputs['stage3_full_response'])
+
+    return result
+
+
+def process_vlguard_item(item, sia_pipeline, image_pool=None):
     """
     Process a single VLGuard item through SIA pipeline.
 
@@ -40,6 +170,7 @@ def process_vlguard_item(item, sia_pipeline):
                   "solution": str (ground truth answer)
               }
         sia_pipeline: SIAPipeline instance
+        image_pool: Optional ImagePoolClient serving shared decoded images
 
     Returns:
         Result dictionary or None if error
@@ -56,42 +187,20 @@ def process_vlguard_item(item, sia_pipeline):
             print(f"Warning: Image not found: {image_path}")
             return None
 
-        image = Image.open(image_path).convert('RGB')
+        if image_pool is not None:
+            image_context = image_pool.open_image(image_path)
+        else:
+            from PIL import Image
+            image_context = nullcontext(Image.open(image_path).convert('RGB'))
         query = item['problem']
 
         # Run SIA pipeline
-        sia_outputs = sia_pipeline.run_full_pipeline(image, query)
+        with image_context as image:
+            sia_outputs = sia_pipeline.run_full_pipeline(
+                image, query, sample_id=item['problem_id']
+            )
 
-        # Detect unsafe intent and refusal
-        sia_detected_unsafe = detect_unsafe_intent(
-            sia_outputs['stage2_intent'],
-            sia_outputs['stage2_reasoning']
-        )
-        sia_refused = detect_refusal(sia_outputs['stage3_final_response'])
-
-        # Build result
-        result = {
-            # Original fields (preserved from VLGuard)
-            'problem_id': item['problem_id'],
-            'problem': query,
-            'path': item['path'],
-            'problem_type': item.get('problem_type', ''),
-            'data_type': item.get('data_type', ''),
-            'solution': item.get('solution', ''),  # Ground truth
-
-            # SIA stage outputs
-            'stage1_caption': sia_outputs['stage1_caption'],
-            'stage2_intent': sia_outputs['stage2_intent'],
-            'stage2_reasoning': sia_outputs['stage2_reasoning'],
-            'stage2_raw_output': sia_outputs['stage2_raw_output'],
-            'stage3_final_response': sia_outputs['stage3_final_response'],
-
-            # Metrics
-            'sia_detected_unsafe': sia_detected_unsafe,
-            'sia_refused': sia_refused
-        }
-
-        return result
+        return build_result(item, sia_outputs)
 
     except Exception as e:
         print(f"Error processing item {item.get('problem_id', 'unknown')}: {e}")
@@ -126,11 +235,40 @@ def main():
     parser.add_argument("--max-new-tokens", type=int, default=1024,
                        help="Maximum tokens per generation")
 
+    # Stage 2 near-duplicate cache arguments
+    parser.add_argument("--stage2-dedup", action="store_true",
+                       help="Reuse Stage 2 outputs for near-duplicate caption+query pairs")
+    parser.add_argument("--dedup-threshold", type=float, default=0.9,
+                       help="Minimum estimated caption Jaccard similarity for Stage 2 reuse")
+    parser.add_argument("--dedup-query-threshold", type=float, default=None,
+                       help="Minimum estimated query Jaccard similarity for Stage 2 reuse "
+                            "(default: require identical normalized queries)")
+    parser.add_argument("--dedup-num-perm", type=int, default=128,
+                       help="Number of MinHash permutations for the Stage 2 cache")
+
+    # Stage 3 fast path arguments
+    parser.add_argument("--fast-path", action="store_true",
+                       help="Run Stage 3 text-only when Stage 2 confidently flags unsafe intent")
+    parser.add_argument("--fast-path-min-indicators", type=int, default=2,
+                       help="Distinct unsafe indicators in Stage 2 output required for the fast path")
+    parser.add_argument("--fast-path-max-new-tokens", type=int, default=None,
+                       help="Token budget for fast-path Stage 3 (default: --max-new-tokens)")
+    parser.add_argument("--fast-path-compare", action="store_true",
+                       help="Also run the full Stage 3 on fast-path samples and report both")
+
+    # Shared image pool arguments
+    parser.add_argument("--image-pool", type=str, default=None,
+                       help="host:port of an image_pool.py loader to share decoded images")
+    parser.add_argument("--image-pool-authkey", type=str, default="sia-image-pool",
+                       help="Auth key of the image pool loader")
+
     # Evaluation arguments
     parser.add_argument("--limit", type=int, default=None,
                        help="Limit number of samples (for testing)")
     parser.add_argument("--offset", type=int, default=0,
                        help="Starting offset in dataset")
+    parser.add_argument("--dry-run", action="store_true",
+                       help="Validate the dataset (fields and image paths) and exit without loading the model")
 
     args = parser.parse_args()
 
@@ -142,40 +280,58 @@ def main():
     print(f"Output: {args.output_file}")
     print(f"Temperature: {args.temperature}")
     print(f"Max tokens: {args.max_new_tokens}")
+    if args.stage2_dedup:
+        print(f"Stage 2 dedup threshold: caption {args.dedup_threshold}, query "
+              f"{args.dedup_query_threshold if args.dedup_query_threshold is not None else 'exact'}")
+    if args.fast_path:
+        print(f"Stage 3 fast path: >= {args.fast_path_min_indicators} unsafe indicators"
+              f"{' (comparing with full path)' if args.fast_path_compare else ''}")
     print("="*60)
 
+    # Load data
+    data = load_data(args.data_file, args.offset, args.limit)
+
+    if args.dry_run:
+        invalid = validate_data(data)
+        for problem_id, problem in invalid:
+            print(f"Warning: Item {problem_id}: {problem}")
+        print(f"\nDry run: {len(data) - len(invalid)}/{len(data)} samples valid")
+        sys.exit(1 if invalid else 0)
+
+    from tqdm import tqdm
+
     # Load model
     print("\nLoading model...")
-    adapter = create_adapter(args.model_type)
-    adapter.load_model(args.model_path)
+    adapter = load_adapter(args.model_type, args.model_path)
     print("Model loaded successfully!")
 
     # Initialize SIA pipeline
     print("\nInitializing SIA pipeline...")
+    stage2_cache = None
+    if args.stage2_dedup:
+        stage2_cache = Stage2DedupCache(
+            threshold=args.dedup_threshold,
+            query_threshold=args.dedup_query_threshold,
+            num_perm=args.dedup_num_perm
+        )
     sia_pipeline = SIAPipeline(
         adapter,
         temperature=args.temperature,
-        max_new_tokens=args.max_new_tokens
+        max_new_tokens=args.max_new_tokens,
+        stage2_cache=stage2_cache,
+        fast_path=args.fast_path,
+        fast_path_min_indicators=args.fast_path_min_indicators,
+        fast_path_max_new_tokens=args.fast_path_max_new_tokens,
+        fast_path_compare=args.fast_path_compare
     )
     print("SIA pipeline initialized!")
 
-    # Load data
-    print(f"\nLoading data from {args.data_file}...")
-    with open(args.data_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    print(f"Total samples in dataset: {len(data)}")
-
-    # Apply offset and limit
-    if args.offset > 0:
-        data = data[args.offset:]
-        print(f"Starting from offset {args.offset}")
-
-    if args.limit:
-        data = data[:args.limit]
-        print(f"Limited to {args.limit} samples")
-
-    print(f"Samples to process: {len(data)}")
+    # Connect to shared image pool
+    image_pool = None
+    if args.image_pool:
+        from image_pool import ImagePoolClient
+        print(f"\nConnecting to image pool at {args.image_pool}...")
+        image_pool = ImagePoolClient(args.image_pool, args.image_pool_authkey)
 
     # Process all items
     print("\nProcessing samples through SIA pipeline...")
@@ -184,7 +340,7 @@ def main():
     failed = 0
 
     for item in tqdm(data, desc="Processing VLGuard with SIA"):
-        result = process_vlguard_item(item, sia_pipeline)
+        result = process_vlguard_item(item, sia_pipeline, image_pool)
         if result:
             results.append(result)
             successful += 1
@@ -213,6 +369,12 @@ def main():
         'metrics': metrics,
         'results': results
     }
+    if stage2_cache is not None:
+        output_data['stage2_cache_stats'] = stage2_cache.stats()
+    if image_pool is not None:
+        output_data['image_pool_stats'] = image_pool.stats()
+    if args.fast_path:
+        output_data['stage3_path_comparison'] = compare_stage3_paths(results)
 
     with open(args.output_file, 'w', encoding='utf-8') as f:
         json.dump(output_data, f, indent=2, ensure_ascii=False)
@@ -230,6 +392,34 @@ def main():
           f"({metrics['refused_count']}/{metrics['total_samples']})")
     print(f"  Alignment Rate: {metrics['alignment_rate']:.2%} "
           f"({metrics['aligned_count']}/{metrics['total_samples']})")
+    if stage2_cache is not None:
+        cache_stats = output_data['stage2_cache_stats']
+        print("\nStage 2 Cache:")
+        print(f"  Hit Rate: {cache_stats['hit_rate']:.2%} "
+              f"({cache_stats['hits']}/{cache_stats['lookups']})")
+        print(f"  Mean Caption Similarity: {cache_stats['mean_caption_similarity']:.3f}")
+        print(f"  Mean Query Similarity: {cache_stats['mean_query_similarity']:.3f}")
+        for field in ('caption', 'query'):
+            print(f"  {field.capitalize()} Similarity Histogram:")
+            for bin_range, count in cache_stats[f'{field}_similarity_histogram'].items():
+                print(f"    {bin_range}: {count}")
+    if args.fast_path:
+        comparison = output_data['stage3_path_comparison']
+        print("\nStage 3 Fast Path:")
+        print(f"  Fast Path Rate: {comparison['fast_path_rate']:.2%} "
+              f"({comparison['fast_path_count']}/{len(results)})")
+        for path, stats in comparison['by_path'].items():
+            print(f"  {path}: refusal {stats['metrics']['refusal_rate']:.2%}, "
+                  f"alignment {stats['metrics']['alignment_rate']:.2%}, "
+                  f"mean latency {stats['mean_latency_s']:.2f}s")
+        paired = comparison['paired']
+        if paired['total_samples']:
+            print(f"  Paired ({paired['total_samples']} samples, fast vs full):")
+            print(f"    Refusal Rate: {paired['fast_refusal_rate']:.2%} vs {paired['full_refusal_rate']:.2%}")
+            print(f"    Alignment Rate: {paired['fast_alignment_rate']:.2%} vs {paired['full_alignment_rate']:.2%}")
+            print(f"    Refusal Agreement: {paired['refusal_agreement_rate']:.2%}")
+            print(f"    Mean Latency: {paired['fast_mean_latency_s']:.2f}s vs "
+                  f"{paired['full_mean_latency_s']:.2f}s ({paired['speedup']:.1f}x)")
     print(f"\nResults saved to: {args.output_file}")
     print("="*60)
 
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Host-local shared-memory pool of decoded images.
+
+When several eval worker processes run on one host, each of them would
+otherwise open and decode the same image files with PIL and keep its own
+RGB copy (HADES reuses images across many prompts). This module provides:
+- A loader process that decodes each image once into shared memory,
+  keyed by path + mtime
+- A worker-side client that attaches to the buffer without copying
+- Reference counting plus LRU eviction bounded by a memory cap
+- References held per worker PID, reclaimed once that worker has exited
+
+Start the loader once per host:
+    python image_pool.py --port 50555 --memory-cap-mb 4096
+
+then pass `--image-pool 127.0.0.1:50555` to eval_vlguard.py workers.
+"""
+
+import argparse
+import os
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.managers import BaseManager
+from typing import Dict, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+DEFAULT_AUTHKEY = 'sia-image-pool'
+
+# Registry methods workers may call; close() stays loader-only
+POOL_EXPOSED = ('acquire', 'release', 'stats')
+
+
+class ImagePoolManager(BaseManager):
+    """Manager exposing the image pool registry over a local socket."""
+
+
+class ImagePoolRegistry:
+    """
+    Loader-side registry of decoded images held in shared memory.
+
+    Lives in the loader process; workers talk to it through an
+    ImagePoolManager proxy. Decoding happens here, outside the registry
+    lock, so concurrent requests for different images do not serialize.
+
+    References are counted per worker PID. The pool is host-local, so when
+    eviction finds pinned entries it checks whether their holders are still
+    running and drops references of workers that crashed or were killed
+    between `acquire` and `release`.
+    """
+
+    def __init__(self, memory_cap_bytes: int):
+        """
+        Initialize the registry.
+
+        Args:
+            memory_cap_bytes: Soft cap on total decoded bytes held in the pool
+        """
+        self.memory_cap_bytes = memory_cap_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> entry dict, in LRU order
+        self._pending: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reaped_clients = 0
+
+    @staticmethod
+    def _key(path: str) -> str:
+        path = os.path.abspath(path)
+        return f"{path}:{os.stat(path).st_mtime_ns}"
+
+    def acquire(self, path: str, client_pid: int) -> Tuple[str, str, Tuple[int, ...]]:
+        """
+        Get (decoding if needed) an image and take a reference on it.
+
+        Args:
+            path: Absolute image file path
+            client_pid: PID of the worker taking the reference
+
+        Returns:
+            Tuple of (key, shared memory name, array shape)
+        """
+        key = self._key(path)
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry['holders'][client_pid] += 1
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return key, entry['shm'].name, entry['shape']
+
+                pending = self._pending.get(key)
+                if pending is None:
+                    self._pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+
+            # Another worker is already decoding this image
+            pending.wait()
+
+        try:
+            with Image.open(path) as image:
+                array = np.asarray(image.convert('RGB'))
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=np.uint8, buffer=shm.buf)[...] = array
+
+            with self._lock:
+                self._evict(array.nbytes)
+                self._entries[key] = {
+                    'shm': shm,
+                    'shape': array.shape,
+                    'nbytes': array.nbytes,
+                    'holders': Counter({client_pid: 1})
+                }
+                self.total_bytes += array.nbytes
+                return key, shm.name, array.shape
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+    def release(self, key: str, client_pid: int):
+        """
+        Drop a reference taken by `acquire`.
+
+        Args:
+            key: Key returned by `acquire`
+            client_pid: PID of the worker that took the reference
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry['holders'][client_pid] -= 1
+            if entry['holders'][client_pid] <= 0:
+                del entry['holders'][client_pid]
+            self._evict(0)
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _reap_dead_holders(self):
+        """Drop references held by workers that have exited. Caller holds the lock."""
+        pids = {pid for entry in self._entries.values() for pid in entry['holders']}
+        dead = {pid for pid in pids if not self._pid_alive(pid)}
+        for pid in dead:
+            for entry in self._entries.values():
+                entry['holders'].pop(pid, None)
+        if dead:
+            self.reaped_clients += len(dead)
+            print(f"Warning: dropped image pool references of exited workers {sorted(dead)}")
+
+    def _evict(self, incoming_bytes: int):
+        """Evict unreferenced entries (LRU first) until the cap is met. Caller holds the lock."""
+        if self.total_bytes + incoming_bytes > self.memory_cap_bytes:
+            self._reap_dead_holders()
+
+        for key in list(self._entries):
+            if self.total_bytes + incoming_bytes <= self.memory_cap_bytes:
+                return
+            entry = self._entries[key]
+            if entry['holders']:
+                continue
+            del self._entries[key]
+            entry['shm'].close()
+            entry['shm'].unlink()
+            self.total_bytes -= entry['nbytes']
+            self.evictions += 1
+
+        if incoming_bytes and self.total_bytes + incoming_bytes > self.memory_cap_bytes:
+            print(f"Warning: image pool over cap ({self.total_bytes + incoming_bytes} > "
+                  f"{self.memory_cap_bytes} bytes), all entries are in use")
+
+    def stats(self) -> Dict:
+        """
+        Summarize pool usage.
+
+        Returns:
+            Dictionary with entry count, memory usage and hit statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'memory_cap_bytes': self.memory_cap_bytes,
+                'referenced_entries': sum(1 for e in self._entries.values() if e['holders']),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'reaped_clients': self.reaped_clients
+            }
+
+    def close(self):
+        """Unlink every shared memory segment owned by the pool."""
+        with self._lock:
+            for entry in self._entries.values():
+                entry['shm'].close()
+                entry['shm'].unlink()
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing segment without letting this process own it.
+
+    Before Python 3.13 attaching registers the segment with the worker's
+    resource tracker, which would unlink it when the worker exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class ImagePoolClient:
+    """
+    Worker-side handle on a running image pool loader.
+
+    Usage:
+        pool = ImagePoolClient('127.0.0.1:50555')
+        with pool.open_image(path) as image:
+            ...
+    """
+
+    def __init__(self, address: str, authkey: str = DEFAULT_AUTHKEY):
+        """
+        Connect to the loader process.
+
+        Args:
+            address: 'host:port' of the loader
+            authkey: Shared secret used by the loader
+        """
+        host, port = address.rsplit(':', 1)
+        manager = ImagePoolManager(address=(host, int(port)), authkey=authkey.encode('utf-8'))
+        manager.connect()
+        self._registry = manager.pool()
+
+    @contextmanager
+    def open_array(self, path: str):
+        """
+        Yield a read-only zero-copy NumPy view (H, W, 3) of a decoded image.
+
+        The view must not be used after the `with` block; the reference
+        is released on exit and the buffer may then be evicted.
+
+        Args:
+            path: Image file path
+        """
+        # Resolve against the worker's cwd, not the loader's
+        key, name, shape = self._registry.acquire(os.path.abspath(path), os.getpid())
+        try:
+            shm = _attach(name)
+        except Exception:
+            self._registry.release(key, os.getpid())
+            raise
+
+        array = np.ndarray(tuple(shape), dtype=np.uint8, buffer=shm.buf)
+        array.flags.writeable = False
+        try:
+            yield array
+        finally:
+            del array
+            try:
+                shm.close()
+            except BufferError:
+                # Caller kept a view alive; the mapping goes away with it
+                pass
+            self._registry.release(key, os.getpid())
+
+    @contextmanager
+    def open_image(self, path: str):
+        """
+        Yield an RGB PIL image backed by the pooled decode.
+
+        PIL stores RGB with four bytes per pixel internally, so this makes
+        one in-process copy from the shared buffer; decoding still happens
+        only once per host. Use `open_array` for a true zero-copy view.
+
+        The copy is made (and the shared view dropped) before yielding, so
+        the segment is detached cleanly and the pool reference is released
+        as soon as the copy exists.
+
+        Args:
+            path: Image file path
+        """
+        with self.open_array(path) as array:
+            image = Image.fromarray(array)
+            del array
+        yield image
+
+    def stats(self) -> Dict:
+        """Return the loader's usage statistics."""
+        return self._registry.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Host-local shared-memory pool of decoded images for SIA workers"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                       help="Address to listen on")
+    parser.add_argument("--port", type=int, default=50555,
+                       help="Port to listen on")
+    parser.add_argument("--authkey", type=str, default=DEFAULT_AUTHKEY,
+                       help="Shared secret workers must present")
+    parser.add_argument("--memory-cap-mb", type=int, default=4096,
+                       help="Soft cap on decoded image memory (MB). Entries referenced by "
+                            "running workers are never evicted; references of exited workers are "
+                            "reclaimed by PID, so workers must share the loader's PID namespace")
+
+    args = parser.parse_args()
+
+    registry = ImagePoolRegistry(args.memory_cap_mb * 1024 * 1024)
+    ImagePoolManager.register('pool', callable=lambda: registry, exposed=POOL_EXPOSED)
+    manager = ImagePoolManager(address=(args.host, args.port), authkey=args.authkey.encode('utf-8'))
+    server = manager.get_server()
+
+    print(f"Image pool listening on {args.host}:{args.port} "
+          f"(cap {args.memory_cap_mb} MB)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Image pool stats: {registry.stats()}")
+        registry.close()
+
+
+# Client-side registration (server side registers with a callable in main)
+ImagePoolManager.register('pool', exposed=POOL_EXPOSED)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,14 @@ This module implements the core SIA (Safety via Intent Awareness) pipeline:
 """
 
 import re
-from typing import Dict, Tuple, Optional
-from PIL import Image
+import time
+from typing import TYPE_CHECKING, Dict, Tuple, Optional
+
+from prompts import P_CAPTION, P_FEWSHOT, P_RESPONSE
+from utils import is_confident_unsafe_intent
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 
 class SIAPipeline:
@@ -22,7 +28,18 @@ class SIAPipeline:
     3. Generate final response conditioned on inferred intent
     """
 
-    def __init__(self, adapter, temperature: float = 0.2, max_new_tokens: int = 1024):
+    def __init__(
+        self,
+        adapter,
+        temperature: float = 0.2,
+        max_new_tokens: int = 1024,
+        stage2_cache=None,
+        prompts: Optional[Dict[str, str]] = None,
+        fast_path: bool = False,
+        fast_path_min_indicators: int = 2,
+        fast_path_max_new_tokens: Optional[int] = None,
+        fast_path_compare: bool = False
+    ):
         """
         Initialize SIA pipeline.
 
@@ -30,21 +47,39 @@ class SIAPipeline:
             adapter: VLM adapter (e.g., Qwen25VLAdapter)
             temperature: Sampling temperature for generation
             max_new_tokens: Maximum tokens per generation
+            stage2_cache: Optional Stage2DedupCache for reusing Stage 2
+                outputs across near-duplicate (caption, query) pairs
+            prompts: Optional overrides for 'P_CAPTION', 'P_FEWSHOT' and/or
+                'P_RESPONSE' (defaults come from prompts.py)
+            fast_path: Run Stage 3 text-only (no image) when Stage 2 flags
+                unsafe intent with high confidence
+            fast_path_min_indicators: Minimum number of distinct unsafe
+                indicators in Stage 2 output to take the fast path
+            fast_path_max_new_tokens: Token budget for fast-path Stage 3
+                (None uses max_new_tokens)
+            fast_path_compare: Also run the full Stage 3 on fast-path
+                samples so both paths can be compared
         """
         self.adapter = adapter
         self.temperature = temperature
         self.max_new_tokens = max_new_tokens
+        self.stage2_cache = stage2_cache
+        self.fast_path = fast_path
+        self.fast_path_min_indicators = fast_path_min_indicators
+        self.fast_path_max_new_tokens = fast_path_max_new_tokens
+        self.fast_path_compare = fast_path_compare
 
-        # Import prompts
-        import sys
-        import os
-        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-        from prompts import P_CAPTION, P_FEWSHOT, P_RESPONSE
+        # Prompt templates (defaults from prompts.py)
         self.P_CAPTION = P_CAPTION
         self.P_FEWSHOT = P_FEWSHOT
         self.P_RESPONSE = P_RESPONSE
 
-    def stage1_caption(self, image: Image.Image) -> str:
+        for name, template in (prompts or {}).items():
+            if name not in ('P_CAPTION', 'P_FEWSHOT', 'P_RESPONSE'):
+                raise ValueError(f"Unknown prompt name: {name}")
+            setattr(self, name, template)
+
+    def stage1_caption(self, image: 'Image.Image') -> str:
         """
         Stage 1: Generate objective image caption.
 
@@ -94,21 +129,24 @@ class SIAPipeline:
 
     def stage3_response(
         self,
-        image: Image.Image,
+        image: Optional['Image.Image'],
         query: str,
         caption: str,
         intent: str,
-        reasoning: str
+        reasoning: str,
+        max_new_tokens: Optional[int] = None
     ) -> str:
         """
         Stage 3: Generate final response conditioned on intent.
 
         Args:
-            image: PIL Image (restored for final response)
+            image: PIL Image (restored for final response), or None for
+                text-only generation on the caption
             query: User's original question
             caption: Caption from Stage 1
             intent: Intent from Stage 2
             reasoning: Reasoning from Stage 2
+            max_new_tokens: Override for the generation budget
 
         Returns:
             Final response text
@@ -123,12 +161,15 @@ class SIAPipeline:
             intent_reasoning=intent_reasoning
         )
 
-        # Generate final response with image
+        if max_new_tokens is None:
+            max_new_tokens = self.max_new_tokens
+
+        # Generate final response (text-only when image is None)
         response = self.adapter.generate(
             query=prompt,
             image=image,
             temperature=self.temperature,
-            max_new_tokens=self.max_new_tokens
+            max_new_tokens=max_new_tokens
         )
 
         return response.strip()
@@ -202,13 +243,59 @@ class SIAPipeline:
 
         return intent, reasoning
 
-    def run_full_pipeline(self, image: Image.Image, query: str) -> Dict:
+    def cached_stage2_intent_inference(
+        self,
+        caption: str,
+        query: str,
+        sample_id=None
+    ) -> Tuple[str, str, str, Optional[Dict]]:
+        """
+        Stage 2 with near-duplicate reuse via `stage2_cache`.
+
+        On a cache hit the stored intent and reasoning are returned without
+        calling the model; on a miss Stage 2 runs normally and its output
+        is added to the cache.
+
+        Args:
+            caption: Generated caption from Stage 1
+            query: User's original question
+            sample_id: Identifier stored with the entry for auditing reuse
+
+        Returns:
+            Tuple of (intent, reasoning, raw_output, cache_info) where
+            cache_info is None if no cache is configured
+        """
+        if self.stage2_cache is None:
+            intent, reasoning, raw_output = self.stage2_intent_inference(caption, query)
+            return intent, reasoning, raw_output, None
+
+        match, signature = self.stage2_cache.lookup(caption, query)
+        if match is not None:
+            cache_info = {
+                'hit': True,
+                'caption_similarity': match['caption_similarity'],
+                'query_similarity': match['query_similarity'],
+                'source_id': match['source_id'],
+                'source_query': match['source_query']
+            }
+            return match['intent'], match['reasoning'], match['raw_output'], cache_info
+
+        intent, reasoning, raw_output = self.stage2_intent_inference(caption, query)
+        self.stage2_cache.add(
+            caption, query, intent, reasoning, raw_output,
+            source_id=sample_id,
+            signature=signature
+        )
+        return intent, reasoning, raw_output, {'hit': False}
+
+    def run_full_pipeline(self, image: 'Image.Image', query: str, sample_id=None) -> Dict:
         """
         Run complete SIA pipeline (3 stages).
 
         Args:
             image: PIL Image
             query: User query
+            sample_id: Optional identifier used to audit Stage 2 cache reuse
 
         Returns:
             Dictionary with all stage outputs:
@@ -217,22 +304,54 @@ class SIAPipeline:
                 'stage2_intent': str,
                 'stage2_reasoning': str,
                 'stage2_raw_output': str,
-                'stage3_final_response': str
+                'stage3_final_response': str,
+                'stage3_path': 'fast' (text-only) or 'full' (with image),
+                'stage3_latency_s': float,
+                'stage2_cache': dict (only if a Stage 2 cache is configured),
+                'stage3_full_response': str and 'stage3_full_latency_s':
+                    float (only for fast-path samples with fast_path_compare)
             }
         """
         # Stage 1: Generate caption
         caption = self.stage1_caption(image)
 
         # Stage 2: Infer intent (text-only)
-        intent, reasoning, raw_stage2 = self.stage2_intent_inference(caption, query)
-
-        # Stage 3: Generate final response
-        final_response = self.stage3_response(image, query, caption, intent, reasoning)
+        intent, reasoning, raw_stage2, cache_info = self.cached_stage2_intent_inference(
+            caption, query, sample_id=sample_id
+        )
 
-        return {
+        # Stage 3: Generate final response, text-only when Stage 2 is
+        # confident the intent is unsafe and the fast path is enabled
+        use_fast_path = (
+            self.fast_path
+            and is_confident_unsafe_intent(intent, reasoning, self.fast_path_min_indicators)
+        )
+        start = time.perf_counter()
+        if use_fast_path:
+            final_response = self.stage3_response(
+                None, query, caption, intent, reasoning,
+                max_new_tokens=self.fast_path_max_new_tokens
+            )
+        else:
+            final_response = self.stage3_response(image, query, caption, intent, reasoning)
+        latency = time.perf_counter() - start
+
+        outputs = {
             'stage1_caption': caption,
             'stage2_intent': intent,
             'stage2_reasoning': reasoning,
             'stage2_raw_output': raw_stage2,
-            'stage3_final_response': final_response
+            'stage3_final_response': final_response,
+            'stage3_path': 'fast' if use_fast_path else 'full',
+            'stage3_latency_s': latency
         }
+        if use_fast_path and self.fast_path_compare:
+            start = time.perf_counter()
+            outputs['stage3_full_response'] = self.stage3_response(
+                image, query, caption, intent, reasoning
+            )
+            outputs['stage3_full_latency_s'] = time.perf_counter() - start
+        if cache_info is not None:
+            outputs['stage2_cache'] = cache_info
+
+        return outputs
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Prompt-ablation sweep for the SIA pipeline.
+
+Runs a grid of prompt variants and generation settings while sharing
+upstream stage outputs instead of rerunning the full pipeline per variant:
+- Each Stage 1 variant runs once per sample
+- Each Stage 2 variant runs once per Stage 1 output
+- Each Stage 3 variant runs once per Stage 2 output
+
+With one Stage 1, N Stage 2 and M Stage 3 variants this is 1 + N + N*M
+generations per sample instead of 3*N*M. A comparison table of
+`calculate_metrics` is reported for every (stage1, stage2, stage3) leaf.
+
+Grid file format (JSON); every key inside a variant is optional:
+    {
+        "stage1": [{"name": "paper"}],
+        "stage2": [
+            {"name": "paper"},
+            {"name": "3shot", "prompt_file": "prompts/fewshot_3shot.txt"}
+        ],
+        "stage3": [
+            {"name": "paper", "temperature": [0.2, 0.7]},
+            {"name": "short", "prompt": "...", "max_new_tokens": 256}
+        ]
+    }
+`prompt_file` paths are relative to the grid file. `temperature` and
+`max_new_tokens` default to the command-line values and may be lists, in
+which case the variant is expanded over every combination. Keys other than
+stage1/stage2/stage3 are rejected.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+
+# Add current directory for SIA modules
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from eval_vlguard import load_adapter, load_data, build_result
+from sia_pipeline import SIAPipeline
+from utils import calculate_metrics
+
+
+# Prompt template driven by each stage
+STAGE_PROMPTS = {
+    'stage1': 'P_CAPTION',
+    'stage2': 'P_FEWSHOT',
+    'stage3': 'P_RESPONSE',
+}
+
+
+def expand_variants(stage, variants, temperature, max_new_tokens, base_dir='.'):
+    """
+    Expand a stage's variant list over its generation settings.
+
+    Args:
+        stage: Stage key ('stage1', 'stage2' or 'stage3')
+        variants: List of variant dicts from the grid file
+        temperature: Default sampling temperature
+        max_new_tokens: Default maximum tokens per generation
+        base_dir: Directory relative `prompt_file` paths are resolved from
+
+    Returns:
+        List of dicts with 'name', 'prompt' (None for the prompts.py
+        default), 'temperature' and 'max_new_tokens'
+    """
+    expanded = []
+    for i, variant in enumerate(variants or [{}]):
+        prompt = variant.get('prompt')
+        if 'prompt_file' in variant:
+            prompt_path = os.path.join(base_dir, variant['prompt_file'])
+            with open(prompt_path, 'r', encoding='utf-8') as f:
+                prompt = f.read()
+
+        temperatures = variant.get('temperature', temperature)
+        token_limits = variant.get('max_new_tokens', max_new_tokens)
+        if not isinstance(temperatures, list):
+            temperatures = [temperatures]
+        if not isinstance(token_limits, list):
+            token_limits = [token_limits]
+
+        base_name = variant.get('name', f"{stage}_v{i}")
+        multiple = len(temperatures) * len(token_limits) > 1
+        for temp, tokens in itertools.product(temperatures, token_limits):
+            name = f"{base_name}@t{temp},n{tokens}" if multiple else base_name
+            expanded.append({
+                'name': name,
+                'prompt': prompt,
+                'temperature': temp,
+                'max_new_tokens': tokens
+            })
+
+    names = [v['name'] for v in expanded]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate variant names in {stage}: {names}")
+    return expanded
+
+
+def build_pipelines(adapter, stage, variants):
+    """
+    Create one SIAPipeline per variant of a stage.
+
+    Args:
+        adapter: Loaded VLM adapter (shared by all pipelines)
+        stage: Stage key
+        variants: Expanded variant dicts
+
+    Returns:
+        Dictionary mapping variant name to SIAPipeline
+    """
+    pipelines = {}
+    for variant in variants:
+        prompts = {}
+        if variant['prompt'] is not None:
+            prompts[STAGE_PROMPTS[stage]] = variant['prompt']
+        pipelines[variant['name']] = SIAPipeline(
+            adapter,
+            temperature=variant['temperature'],
+            max_new_tokens=variant['max_new_tokens'],
+            prompts=prompts
+        )
+    return pipelines
+
+
+def sweep_item(item, stage1, stage2, stage3):
+    """
+    Run every variant combination for a single item, sharing upstream outputs.
+
+    Args:
+        item: VLGuard data item
+        stage1: Dict of Stage 1 variant name -> SIAPipeline
+        stage2: Dict of Stage 2 variant name -> SIAPipeline
+        stage3: Dict of Stage 3 variant name -> SIAPipeline
+
+    Returns:
+        Dictionary mapping (stage1, stage2, stage3) names to result dicts,
+        or None if the item could not be processed
+    """
+    try:
+        if not all(k in item for k in ['problem_id', 'problem', 'path']):
+            print("Warning: Item missing required fields, skipping")
+            return None
+
+        image_path = item['path']
+        if not os.path.exists(image_path):
+            print(f"Warning: Image not found: {image_path}")
+            return None
+
+        from PIL import Image
+        image = Image.open(image_path).convert('RGB')
+        query = item['problem']
+
+        results = {}
+        for s1_name, s1_pipeline in stage1.items():
+            caption = s1_pipeline.stage1_caption(image)
+
+            for s2_name, s2_pipeline in stage2.items():
+                intent, reasoning, raw_stage2 = s2_pipeline.stage2_intent_inference(caption, query)
+
+                for s3_name, s3_pipeline in stage3.items():
+                    final_response = s3_pipeline.stage3_response(
+                        image, query, caption, intent, reasoning
+                    )
+                    results[(s1_name, s2_name, s3_name)] = build_result(item, {
+                        'stage1_caption': caption,
+                        'stage2_intent': intent,
+                        'stage2_reasoning': reasoning,
+                        'stage2_raw_output': raw_stage2,
+                        'stage3_final_response': final_response
+                    })
+
+        return results
+
+    except Exception as e:
+        print(f"Error processing item {item.get('problem_id', 'unknown')}: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def format_comparison_table(variant_metrics):
+    """
+    Format per-variant metrics as a plain-text comparison table.
+
+    Args:
+        variant_metrics: List of dicts with 'stage1', 'stage2', 'stage3'
+                         and 'metrics' keys
+
+    Returns:
+        Table string
+    """
+    headers = ['Stage 1', 'Stage 2', 'Stage 3', 'N', 'Detection', 'Refusal', 'Alignment']
+    rows = []
+    for entry in variant_metrics:
+        metrics = entry['metrics']
+        rows.append([
+            entry['stage1'],
+            entry['stage2'],
+            entry['stage3'],
+            str(metrics['total_samples']),
+            f"{metrics['detection_rate']:.2%}",
+            f"{metrics['refusal_rate']:.2%}",
+            f"{metrics['alignment_rate']:.2%}"
+        ])
+
+    widths = [max(len(row[i]) for row in [headers] + rows) for i in range(len(headers))]
+    lines = ["  ".join(h.ljust(w) for h, w in zip(headers, widths)).rstrip()]
+    lines.append("  ".join('-' * w for w in widths))
+    for row in rows:
+        lines.append("  ".join(c.ljust(w) for c, w in zip(row, widths)).rstrip())
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="SIA prompt-ablation sweep sharing upstream stage outputs"
+    )
+
+    # Model arguments
+    parser.add_argument("--model-path", type=str,
+                       default="/home/gwj/gwj_sdd/model/Qwen2.5-VL-3B-Instruct",
+                       help="Path to Qwen2.5-VL model")
+    parser.add_argument("--model-type", type=str, default="qwen2.5-vl",
+                       help="Type of VLM (default: qwen2.5-vl)")
+
+    # Data arguments
+    parser.add_argument("--data-file", type=str,
+                       default="/home/gwj/gwj_sdd/dataset/VLGuard/vlguard_dataset.json",
+                       help="Path to VLGuard dataset JSON")
+    parser.add_argument("--grid-file", type=str, required=True,
+                       help="JSON file describing prompt/generation variants per stage")
+    parser.add_argument("--output-file", type=str,
+                       default="results/vlguard_sia_sweep.json",
+                       help="Output file path for sweep results")
+
+    # Default generation arguments (overridable per variant)
+    parser.add_argument("--temperature", type=float, default=0.2,
+                       help="Default sampling temperature")
+    parser.add_argument("--max-new-tokens", type=int, default=1024,
+                       help="Default maximum tokens per generation")
+
+    # Evaluation arguments
+    parser.add_argument("--limit", type=int, default=None,
+                       help="Limit number of samples (for testing)")
+    parser.add_argument("--offset", type=int, default=0,
+                       help="Starting offset in dataset")
+
+    args = parser.parse_args()
+
+    with open(args.grid_file, 'r', encoding='utf-8') as f:
+        grid = json.load(f)
+
+    unknown = sorted(set(grid) - set(STAGE_PROMPTS))
+    if unknown:
+        raise ValueError(f"Unknown keys in grid file {args.grid_file}: {unknown} "
+                         f"(expected {sorted(STAGE_PROMPTS)})")
+
+    grid_dir = os.path.dirname(os.path.abspath(args.grid_file))
+    variants = {
+        stage: expand_variants(stage, grid.get(stage), args.temperature,
+                               args.max_new_tokens, base_dir=grid_dir)
+        for stage in STAGE_PROMPTS
+    }
+    n1, n2, n3 = (len(variants[stage]) for stage in STAGE_PROMPTS)
+
+    print("="*60)
+    print("SIA Prompt-Ablation Sweep")
+    print("="*60)
+    print(f"Model: {args.model_path}")
+    print(f"Data: {args.data_file}")
+    print(f"Grid: {args.grid_file}")
+    print(f"Output: {args.output_file}")
+    for stage in STAGE_PROMPTS:
+        print(f"{stage} variants: {[v['name'] for v in variants[stage]]}")
+    print(f"Generations per sample: {n1 + n1 * n2 + n1 * n2 * n3} "
+          f"(vs {3 * n1 * n2 * n3} without sharing)")
+    print("="*60)
+
+    from tqdm import tqdm
+
+    # Load model
+    print("\nLoading model...")
+    adapter = load_adapter(args.model_type, args.model_path)
+    print("Model loaded successfully!")
+
+    stage1 = build_pipelines(adapter, 'stage1', variants['stage1'])
+    stage2 = build_pipelines(adapter, 'stage2', variants['stage2'])
+    stage3 = build_pipelines(adapter, 'stage3', variants['stage3'])
+
+    # Load data
+    data = load_data(args.data_file, args.offset, args.limit)
+
+    # Process all items
+    print("\nRunning sweep...")
+    leaf_results = {
+        key: [] for key in itertools.product(stage1, stage2, stage3)
+    }
+    successful = 0
+    failed = 0
+
+    for item in tqdm(data, desc="Sweeping SIA prompt variants"):
+        item_results = sweep_item(item, stage1, stage2, stage3)
+        if item_results:
+            for key, result in item_results.items():
+                leaf_results[key].append(result)
+            successful += 1
+        else:
+            failed += 1
+
+    # Calculate metrics per leaf
+    print("\nCalculating metrics...")
+    variant_metrics = []
+    for (s1_name, s2_name, s3_name), results in leaf_results.items():
+        variant_metrics.append({
+            'stage1': s1_name,
+            'stage2': s2_name,
+            'stage3': s3_name,
+            'metrics': calculate_metrics(results),
+            'results': results
+        })
+
+    # Save results
+    print(f"\nSaving results to {args.output_file}...")
+    os.makedirs(os.path.dirname(args.output_file), exist_ok=True)
+
+    output_data = {
+        'metadata': {
+            'model_path': args.model_path,
+            'model_type': args.model_type,
+            'data_file': args.data_file,
+            'grid_file': args.grid_file,
+            'total_samples': len(data),
+            'successful': successful,
+            'failed': failed
+        },
+        'variants': variants,
+        'sweep': variant_metrics
+    }
+
+    with open(args.output_file, 'w', encoding='utf-8') as f:
+        json.dump(output_data, f, indent=2, ensure_ascii=False)
+
+    # Print comparison table
+    print("\n" + "="*60)
+    print("SIA Sweep Complete!")
+    print("="*60)
+    print(f"Total processed: {successful}")
+    print(f"Failed: {failed}\n")
+    print(format_comparison_table(variant_metrics))
+    print(f"\nResults saved to: {args.output_file}")
+    print("="*60)
+
+
+if __name__ == "__main__":
+    main()